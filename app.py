@@ -1,18 +1,32 @@
 import os
-import tempfile
+import hashlib
 import streamlit as st
 from streamlit_chat import message
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
-import time
-from typing import Dict, List, Optional
+from collections import OrderedDict
+import tiktoken
+from io import BytesIO, StringIO
+from typing import Dict, Iterator, List, Optional
 
 from document_processor import DocumentProcessor
-from vector_store import VectorStore
+from vector_store import VectorStore, load_embedding_model
+from semantic_cache import SemanticCache
 
 load_dotenv()
 
+# Prior turns sent with each question are trimmed oldest-first to stay within this many tokens
+HISTORY_TOKEN_BUDGET = 2000
+
+# Completed OpenRouter responses kept for identical (model, messages, temperature) requests
+RESPONSE_CACHE_SIZE = 128
+
+# Hard cap on document context characters sent with a question (about 6k tokens)
+MAX_CONTEXT_CHARS = 24000
+
 st.set_page_config(
     page_title="Custom Document Chatbot",
     page_icon="🤖",
@@ -116,6 +130,51 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource(show_spinner="Loading embedding model...")
+def get_embed_model(model_name: str, device: str):
+    """Load the embedding model once per process and share it across reruns and sessions"""
+    return load_embedding_model(model_name, device)
+
+@st.cache_data(ttl=600, max_entries=256, show_spinner=False)
+def memoized_search(query: str, document_id: str, k: int, _vector_store: VectorStore) -> List[Dict]:
+    """Search results memoized per (query, document content, k); the store itself is not hashed"""
+    # Errors propagate so st.cache_data never stores a failed search
+    return _vector_store.search_or_raise(query, k=k)
+
+def cached_search(query: str, document_id: str, k: int, vector_store: VectorStore) -> List[Dict]:
+    try:
+        return memoized_search(query, document_id, k, vector_store)
+    except Exception as e:
+        print(f"Search error: {e}")
+        return []
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """Shared keep-alive session, so repeat OpenRouter calls skip the TCP/TLS handshake"""
+    session = requests.Session()
+    session.headers.update({"Content-Type": "application/json"})
+    # Retry gateway errors only; a read timeout on a POST may already be generating (and billing),
+    # so read errors are re-raised as-is rather than retried
+    retry = Retry(
+        total=3,
+        read=False,
+        backoff_factor=0.3,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["POST"],
+        raise_on_status=False
+    )
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry))
+    return session
+
+@st.cache_resource
+def get_response_cache() -> "OrderedDict[str, str]":
+    """Process-wide LRU of successful completions, keyed by a hash of the request"""
+    return OrderedDict()
+
+@st.cache_resource
+def get_token_encoder():
+    return tiktoken.get_encoding("cl100k_base")
+
 def initialize_session_state():
     if "messages" not in st.session_state:
         st.session_state.messages = []
@@ -123,8 +182,14 @@ def initialize_session_state():
     if "conversation_history" not in st.session_state:
         st.session_state.conversation_history = []
 
+    if "history_tokens" not in st.session_state:
+        st.session_state.history_tokens = []
+
     if "vector_store" not in st.session_state:
-        st.session_state.vector_store = VectorStore()
+        st.session_state.vector_store = VectorStore(model_loader=get_embed_model)
+
+    if "semantic_cache" not in st.session_state:
+        st.session_state.semantic_cache = SemanticCache(threshold=0.92, max_entries=1024)
 
     if "document_processed" not in st.session_state:
         st.session_state.document_processed = False
@@ -135,6 +200,9 @@ def initialize_session_state():
     if "uploaded_file_name" not in st.session_state:
         st.session_state.uploaded_file_name = None
 
+    if "document_id" not in st.session_state:
+        st.session_state.document_id = None
+
     if "uploaded_file_size" not in st.session_state:
         st.session_state.uploaded_file_size = None
 
@@ -159,17 +227,47 @@ def initialize_session_state():
 
 initialize_session_state()
 
-def call_openrouter_api(messages: List[Dict], temperature: float = 0.3) -> str:
+def error_separator(parts: List[str]) -> str:
+    """Blank line to set an error message apart from any partial answer already streamed"""
+    return "\n\n" if parts else ""
+
+def call_openrouter_api(messages: List[Dict], temperature: float = 0.3,
+                        status: Optional[Dict] = None) -> Iterator[str]:
+    """Stream the completion from OpenRouter, yielding content deltas as they arrive.
+
+    Failures are yielded as readable messages and also flagged in status["error"],
+    since an error can arrive after part of the answer has already been streamed.
+    """
+    if status is None:
+        status = {}
+    status["error"] = False
+    status["completed"] = False
+
     api_key = st.session_state.api_key
     model = os.getenv("OPENROUTER_MODEL", "openai/gpt-oss-120b:free")
 
     if not api_key:
-        return "Error: OpenRouter API key not configured. Please add it to Streamlit Secrets or .env file."
-
+        status["error"] = True
+        yield "Error: OpenRouter API key not configured. Please add it to Streamlit Secrets or .env file."
+        return
+
+    request_key = hashlib.blake2b(
+        json.dumps({"m": model, "msgs": messages, "t": temperature}, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    response_cache = get_response_cache()
+
+    # pop-and-reinsert marks the entry most recently used
+    cached_answer = response_cache.pop(request_key, None)
+    if cached_answer is not None:
+        response_cache[request_key] = cached_answer
+        status["completed"] = True
+        yield cached_answer
+        return
+
+    parts = []
     try:
         headers = {
             "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
             "HTTP-Referer": "https://custom-document-chatbot.streamlit.app",
             "X-Title": "Custom Document Chatbot"
         }
@@ -178,35 +276,112 @@ def call_openrouter_api(messages: List[Dict], temperature: float = 0.3) -> str:
             "model": model,
             "messages": messages,
             "temperature": temperature,
-            "max_tokens": 800
+            "max_tokens": 800,
+            "stream": True
         }
 
-        response = requests.post(
+        with get_http_session().post(
             "https://openrouter.ai/api/v1/chat/completions",
             headers=headers,
             json=data,
-            timeout=30
-        )
-
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content']
-        else:
-            error_msg = f"API Error {response.status_code}: {response.text}"
-            if response.status_code == 429:
-                error_msg = "Rate limit exceeded. Please wait a moment and try again."
-            elif response.status_code == 401:
-                error_msg = "Invalid API key. Please check your API key in Streamlit Secrets."
-            elif response.status_code == 404:
-                error_msg = "Model not found. Please check your OpenRouter privacy settings to allow free model training."
-            return f"Error: {error_msg}"
+            timeout=30,
+            stream=True
+        ) as response:
+
+            if response.status_code != 200:
+                error_msg = f"API Error {response.status_code}: {response.text}"
+                if response.status_code == 429:
+                    error_msg = "Rate limit exceeded. Please wait a moment and try again."
+                elif response.status_code == 401:
+                    error_msg = "Invalid API key. Please check your API key in Streamlit Secrets."
+                elif response.status_code == 404:
+                    error_msg = "Model not found. Please check your OpenRouter privacy settings to allow free model training."
+                status["error"] = True
+                yield f"Error: {error_msg}"
+                return
+
+            # Server-sent events: "data: {...}" lines, keep-alive comments, then "data: [DONE]"
+            finished = False
+            for line in response.iter_lines():
+                if not line or not line.startswith(b"data: "):
+                    continue
+
+                payload = line[len(b"data: "):].decode("utf-8")
+                if payload.strip() == "[DONE]":
+                    finished = True
+                    break
+
+                chunk = json.loads(payload)
+                if "error" in chunk:
+                    # OpenRouter sends {"message": ...}, but tolerate a bare string too
+                    error = chunk["error"]
+                    error_msg = error.get("message", "Stream interrupted") if isinstance(error, dict) else str(error)
+                    status["error"] = True
+                    yield f"{error_separator(parts)}Error: {error_msg}"
+                    return
+
+                choices = chunk.get("choices") or [{}]
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    parts.append(content)
+                    yield content
+
+            # A stream that closes without [DONE] was cut short; an empty completion is not worth replaying
+            status["completed"] = finished
+            if not finished:
+                status["error"] = True
+                yield f"{error_separator(parts)}Error: The response was cut off. Please try again."
+            elif parts:
+                response_cache[request_key] = "".join(parts)
+                while len(response_cache) > RESPONSE_CACHE_SIZE:
+                    response_cache.popitem(last=False)
 
     except requests.exceptions.Timeout:
-        return "Error: Request timed out. Please try again."
+        status["error"] = True
+        yield f"{error_separator(parts)}Error: Request timed out. Please try again."
     except requests.exceptions.ConnectionError:
-        return "Error: Connection failed. Please check your internet connection."
+        status["error"] = True
+        yield f"{error_separator(parts)}Error: Connection failed. Please check your internet connection."
     except Exception as e:
-        return f"Error calling OpenRouter API: {str(e)}"
+        status["error"] = True
+        yield f"{error_separator(parts)}Error calling OpenRouter API: {str(e)}"
+
+def append_to_history(query: str, answer: str):
+    """Record a question/answer pair and drop the oldest pairs until the history fits the token budget"""
+    encoder = get_token_encoder()
+    st.session_state.conversation_history.append({"role": "user", "content": query})
+    st.session_state.conversation_history.append({"role": "assistant", "content": answer})
+    st.session_state.history_tokens.append(len(encoder.encode(query)))
+    st.session_state.history_tokens.append(len(encoder.encode(answer)))
+
+    # Turns are removed two at a time so the history always starts with a user turn
+    while st.session_state.history_tokens and sum(st.session_state.history_tokens) >= HISTORY_TOKEN_BUDGET:
+        del st.session_state.conversation_history[:2]
+        del st.session_state.history_tokens[:2]
+
+def build_context(results: List[Dict], max_chars: int = MAX_CONTEXT_CHARS) -> str:
+    """Join retrieved chunks into one context string, truncated at max_chars"""
+    buf = StringIO()
+    for r in results:
+        separator = "\n\n" if buf.tell() else ""
+        header = f"{separator}[Chunk {r['rank']}] "
+        remaining = max_chars - buf.tell() - len(header)
+        if remaining <= 0:
+            break
+
+        buf.write(header)
+        buf.write(r['content'][:remaining])
+    return buf.getvalue()
+
+def record_answer_source(source: str):
+    """Count an answer toward the document/AI answer statistics"""
+    if source == "document":
+        st.session_state.stats["document_answers"] += 1
+    elif source == "mixed":
+        st.session_state.stats["document_answers"] += 0.5
+        st.session_state.stats["ai_answers"] += 0.5
+    else:
+        st.session_state.stats["ai_answers"] += 1
 
 def get_smart_answer(query: str, context: Optional[str] = None) -> Dict:
     messages = []
@@ -247,73 +422,63 @@ Please provide the best possible answer following the instructions above."""
         ]
 
     if st.session_state.conversation_history:
-        history = st.session_state.conversation_history[-4:]
+        history = st.session_state.conversation_history
         for msg in history:
             messages.insert(-1, msg)
 
-    answer = call_openrouter_api(messages, temperature=0.2)
+    # Render tokens as they arrive; write_stream returns the full text once the stream ends
+    stream_status = {}
+    answer = st.write_stream(call_openrouter_api(messages, temperature=0.2, status=stream_status)) or ""
 
     if context:
         if "Based on your document" in answer:
             source = "document"
-            st.session_state.stats["document_answers"] += 1
         elif "Based on general knowledge" in answer:
             source = "ai"
-            st.session_state.stats["ai_answers"] += 1
         elif "Mixed sources" in answer:
             source = "mixed"
-            st.session_state.stats["document_answers"] += 0.5
-            st.session_state.stats["ai_answers"] += 0.5
         else:
             source = "ai"
-            st.session_state.stats["ai_answers"] += 1
     else:
         source = "ai"
-        st.session_state.stats["ai_answers"] += 1
+    record_answer_source(source)
 
     return {
         "answer": answer,
         "source": source,
-        "context_used": bool(context)
+        "context_used": bool(context),
+        "error": stream_status.get("error", True),
+        "completed": stream_status.get("completed", False) and not stream_status.get("error", True)
     }
 
 def process_uploaded_document(uploaded_file) -> bool:
     try:
         suffix = os.path.splitext(uploaded_file.name)[1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_path = tmp_file.name
+        file_bytes = uploaded_file.getvalue()
 
-        file_size_mb = len(uploaded_file.getvalue()) / (1024 * 1024)
+        file_size_mb = len(file_bytes) / (1024 * 1024)
         st.session_state.uploaded_file_size = f"{file_size_mb:.2f} MB"
 
+        # The upload is already in memory, so parse it there rather than via a temp file
         processor = DocumentProcessor()
-        chunks = processor.process_document(tmp_path)
+        chunks = processor.process_stream(BytesIO(file_bytes), ext=suffix)
 
         if not chunks:
             st.error("Could not extract readable text from this document.")
-            os.unlink(tmp_path)
             return False
 
-        metadata = [{
-            "source_file": uploaded_file.name,
-            "chunk_id": i,
-            "word_count": len(chunk.split()),
-            "char_count": len(chunk),
-            "processed_at": time.strftime("%Y-%m-%d %H:%M:%S")
-        } for i, chunk in enumerate(chunks)]
-
         st.session_state.vector_store.clear()
-        st.session_state.vector_store.add_documents(chunks, metadata)
+        st.session_state.vector_store.add_documents(chunks, source_file=uploaded_file.name)
 
         st.session_state.document_processed = True
         st.session_state.uploaded_file_name = uploaded_file.name
+        st.session_state.document_id = hashlib.sha256(file_bytes).hexdigest()
         st.session_state.stats["total_chunks"] = len(chunks)
 
         st.session_state.messages = []
         st.session_state.conversation_history = []
-
-        os.unlink(tmp_path)
+        st.session_state.history_tokens = []
+        st.session_state.semantic_cache.clear()
 
         return True
 
@@ -356,8 +521,11 @@ def render_sidebar():
                     st.session_state.vector_store.clear()
                     st.session_state.document_processed = False
                     st.session_state.uploaded_file_name = None
+                    st.session_state.document_id = None
                     st.session_state.messages = []
                     st.session_state.conversation_history = []
+                    st.session_state.history_tokens = []
+                    st.session_state.semantic_cache.clear()
                     st.session_state.stats["total_chunks"] = 0
                     st.success("Document cleared!")
                     st.rerun()
@@ -456,56 +624,79 @@ def render_chat_interface():
 
         mode = st.session_state.answering_mode
 
-        if mode == "AI Only" or not st.session_state.document_processed:
-            with st.spinner("Thinking..."):
-                response = get_smart_answer(query, context=None)
-
-        elif mode == "Document Only":
-            with st.spinner("Searching document..."):
-                search_results = st.session_state.vector_store.search(query, k=3)
-
-                if search_results:
-                    context = "\n\n".join([f"[Chunk {r['rank']}] {r['content']}"
-                                         for r in search_results])
-                    response = get_smart_answer(query, context=context)
-                else:
-                    response = {
-                        "answer": "No relevant information found in your document.\\n\\nPlease ask something related to the document content, or switch to Smart/AI mode for general answers.",
-                        "source": "document",
-                        "context_used": True
-                    }
+        with chat_container:
+            message(query, is_user=True, key=f"user_{len(st.session_state.messages) - 1}")
 
-        else:
-            with st.spinner("Searching document..."):
-                search_results = st.session_state.vector_store.search(query, k=3)
+            # Near-duplicate questions against the same document and mode reuse the earlier answer.
+            # Without a document there is no loaded model to embed with, so the cache is skipped.
+            query_vector = None
+            cached_response = None
+            cache_scope = (st.session_state.document_id, mode)
+            if st.session_state.document_processed:
+                try:
+                    query_vector = st.session_state.vector_store.embed_query(query)
+                    cached_response = st.session_state.semantic_cache.lookup(query_vector, cache_scope)
+                except Exception as e:
+                    print(f"Semantic cache error: {e}")
+                    query_vector = None
+
+            if cached_response is not None:
+                response = cached_response
+                record_answer_source(response.get("source", "ai"))
+
+            elif mode == "AI Only" or not st.session_state.document_processed:
+                with st.spinner("Thinking..."):
+                    response = get_smart_answer(query, context=None)
+
+            elif mode == "Document Only":
+                with st.spinner("Searching document..."):
+                    search_results = cached_search(query, st.session_state.document_id, 3,
+                                                   st.session_state.vector_store)
+
+                    if search_results:
+                        context = build_context(search_results)
+                        response = get_smart_answer(query, context=context)
+                    else:
+                        response = {
+                            "answer": "No relevant information found in your document.\\n\\nPlease ask something related to the document content, or switch to Smart/AI mode for general answers.",
+                            "source": "document",
+                            "context_used": True
+                        }
 
-                if search_results:
-                    best_score = max([r.get('score', 0) for r in search_results])
+            else:
+                with st.spinner("Searching document..."):
+                    search_results = cached_search(query, st.session_state.document_id, 3,
+                                                   st.session_state.vector_store)
 
-                    if best_score > 0.2:
-                        context = "\n\n".join([f"[Chunk {r['rank']}] {r['content']}"
-                                             for r in search_results])
+                    if search_results:
+                        best_score = max([r.get('score', 0) for r in search_results])
 
-                        with st.spinner("Combining document & AI knowledge..."):
-                            response = get_smart_answer(query, context=context)
+                        if best_score > 0.2:
+                            context = build_context(search_results)
 
-                        if best_score < 0.4:
-                            response["answer"] = f"Note: This topic has weak relevance to your document (similarity: {best_score:.1%})\\n\\n" + response["answer"]
+                            with st.spinner("Combining document & AI knowledge..."):
+                                response = get_smart_answer(query, context=context)
 
-                    else:
-                        context = "\n\n".join([f"[Chunk {r['rank']}] {r['content']}"
-                                             for r in search_results[:1]])
+                            if best_score < 0.4:
+                                response["answer"] = f"Note: This topic has weak relevance to your document (similarity: {best_score:.1%})\\n\\n" + response["answer"]
 
-                        with st.spinner("Getting AI answer with weak document context..."):
-                            response = get_smart_answer(query, context=context)
+                        else:
+                            context = build_context(search_results[:1])
 
-                        response["answer"] = f"Note: Weak document relevance ({best_score:.1%} similarity)\\n\\n" + response["answer"]
+                            with st.spinner("Getting AI answer with weak document context..."):
+                                response = get_smart_answer(query, context=context)
 
-                else:
-                    with st.spinner("Getting general AI answer..."):
-                        response = get_smart_answer(query, context=None)
+                            response["answer"] = f"Note: Weak document relevance ({best_score:.1%} similarity)\\n\\n" + response["answer"]
 
-                    response["answer"] = "Note: No relevant content found in your document. Here's a general answer:\\n\\n" + response["answer"]
+                    else:
+                        with st.spinner("Getting general AI answer..."):
+                            response = get_smart_answer(query, context=None)
+
+                        response["answer"] = "Note: No relevant content found in your document. Here's a general answer:\\n\\n" + response["answer"]
+
+        # Only answers whose stream ran to completion are reused
+        if query_vector is not None and cached_response is None and response.get("completed"):
+            st.session_state.semantic_cache.add(query_vector, cache_scope, response)
 
         st.session_state.messages.append({
             "role": "assistant",
@@ -513,11 +704,7 @@ def render_chat_interface():
             "source": response.get("source", "ai")
         })
 
-        st.session_state.conversation_history.append({"role": "user", "content": query})
-        st.session_state.conversation_history.append({"role": "assistant", "content": response["answer"]})
-
-        if len(st.session_state.conversation_history) > 10:
-            st.session_state.conversation_history = st.session_state.conversation_history[-10:]
+        append_to_history(query, response["answer"])
 
         st.rerun()
 
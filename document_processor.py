@@ -1,34 +1,82 @@
 import os
-import PyPDF2
-from docx import Document as DocxDocument
-from typing import List
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, List, Union
 import re
 
+# PDFs with at least this many pages are split across worker processes
+PARALLEL_PDF_PAGES = 100
+
+_BLANK_LINES_RE = re.compile(r'\n\s*\n')
+_SPACES_RE = re.compile(r'[ \t]+')
+_WORD_RE = re.compile(r'\S+')
+
+def normalize_newlines(text: str) -> str:
+    """Convert \r\n and lone \r line breaks to \n, as text-mode file reads do"""
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+def extract_pdf_pages(source: Union[str, bytes], start: int, stop: int) -> List[str]:
+    """Extract the text of pages [start, stop) from a PDF path or in-memory PDF bytes"""
+    import pypdfium2 as pdfium
+    
+    pdf = pdfium.PdfDocument(source)
+    try:
+        texts = []
+        for page_num in range(start, stop):
+            page = pdf[page_num]
+            textpage = page.get_textpage()
+            # pdfium reports line breaks as \r\n; normalize so they never reach chunks
+            texts.append(normalize_newlines(textpage.get_text_bounded()))
+            textpage.close()
+            page.close()
+        return texts
+    finally:
+        pdf.close()
+
 class DocumentProcessor:
     def __init__(self, chunk_size=800, chunk_overlap=150):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
     
-    def read_pdf(self, file_path: str) -> str:
-        """Extract text from PDF file"""
+    def read_pdf(self, stream: BinaryIO) -> str:
+        """Extract text from a PDF file object"""
+        import pypdfium2 as pdfium
+        
         text = ""
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page_num, page in enumerate(pdf_reader.pages):
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += f"--- Page {page_num + 1} ---\n"
-                        text += page_text + "\n\n"
+            data = stream.read()
+            pdf = pdfium.PdfDocument(data)
+            page_count = len(pdf)
+            pdf.close()
+            
+            workers = os.cpu_count() or 1
+            if page_count >= PARALLEL_PDF_PAGES and workers > 1:
+                # Pages are independent, so extract contiguous page ranges in parallel
+                step = -(-page_count // workers)
+                ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+                # Spawn rather than fork: forking the multi-threaded Streamlit server is unsafe
+                with ProcessPoolExecutor(max_workers=workers,
+                                         mp_context=multiprocessing.get_context("spawn")) as executor:
+                    futures = [executor.submit(extract_pdf_pages, data, start, stop) for start, stop in ranges]
+                    page_texts = [page for future in futures for page in future.result()]
+            else:
+                page_texts = extract_pdf_pages(data, 0, page_count)
+            
+            for page_num, page_text in enumerate(page_texts):
+                if page_text:
+                    text += f"--- Page {page_num + 1} ---\n"
+                    text += page_text + "\n\n"
             return text.strip()
         except Exception as e:
             raise Exception(f"Failed to read PDF: {str(e)}")
     
-    def read_docx(self, file_path: str) -> str:
-        """Extract text from DOCX file"""
+    def read_docx(self, stream: BinaryIO) -> str:
+        """Extract text from a DOCX file object"""
+        from docx import Document as DocxDocument
+        
         text = ""
         try:
-            doc = DocxDocument(file_path)
+            doc = DocxDocument(stream)
             for para in doc.paragraphs:
                 if para.text.strip():
                     text += para.text + "\n"
@@ -36,15 +84,14 @@ class DocumentProcessor:
         except Exception as e:
             raise Exception(f"Failed to read DOCX: {str(e)}")
     
-    def read_txt(self, file_path: str) -> str:
-        """Extract text from TXT/MD file"""
+    def read_txt(self, stream: BinaryIO) -> str:
+        """Extract text from a TXT/MD file object"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
+            raw = stream.read()
+            return normalize_newlines(raw.decode('utf-8'))
         except UnicodeDecodeError:
             try:
-                with open(file_path, 'r', encoding='latin-1') as file:
-                    return file.read()
+                return normalize_newlines(raw.decode('latin-1'))
             except:
                 raise Exception("Failed to read text file with multiple encodings")
         except Exception as e:
@@ -56,37 +103,40 @@ class DocumentProcessor:
             return []
         
         # Clean text
-        text = re.sub(r'\n\s*\n', '\n\n', text)
-        text = re.sub(r'[ \t]+', ' ', text)
+        text = _BLANK_LINES_RE.sub('\n\n', text)
+        text = _SPACES_RE.sub(' ', text)
+        
+        # Word boundaries as offsets into the cleaned text, so chunks are slices rather than re-joined words
+        starts, ends = [], []
+        for match in _WORD_RE.finditer(text):
+            starts.append(match.start())
+            ends.append(match.end())
         
-        words = text.split()
-        if len(words) <= self.chunk_size:
-            return [' '.join(words)]
+        if not starts:
+            return []
+        if len(starts) <= self.chunk_size:
+            return [text[starts[0]:ends[-1]]]
         
         chunks = []
-        for i in range(0, len(words), self.chunk_size - self.chunk_overlap):
-            chunk = ' '.join(words[i:i + self.chunk_size])
-            chunks.append(chunk)
+        for i in range(0, len(starts), self.chunk_size - self.chunk_overlap):
+            last = min(i + self.chunk_size, len(starts)) - 1
+            chunks.append(text[starts[i]:ends[last]])
             
-            if i + self.chunk_size >= len(words):
+            if i + self.chunk_size >= len(starts):
                 break
         
         return chunks
     
-    def process_document(self, file_path: str) -> List[str]:
-        """Main method to process any document"""
-        if not os.path.exists(file_path):
-            raise Exception(f"File not found: {file_path}")
-        
-        _, ext = os.path.splitext(file_path)
+    def process_stream(self, stream: BinaryIO, ext: str) -> List[str]:
+        """Process a document held in a binary file object, dispatching on its extension"""
         ext = ext.lower()
         
         if ext == '.pdf':
-            text = self.read_pdf(file_path)
+            text = self.read_pdf(stream)
         elif ext == '.docx':
-            text = self.read_docx(file_path)
+            text = self.read_docx(stream)
         elif ext in ['.txt', '.md']:
-            text = self.read_txt(file_path)
+            text = self.read_txt(stream)
         else:
             raise Exception(f"Unsupported file type: {ext}")
         
@@ -98,4 +148,13 @@ class DocumentProcessor:
         if not chunks:
             raise Exception("Failed to create text chunks from document")
         
-        return chunks
\ No newline at end of file
+        return chunks
+    
+    def process_document(self, file_path: str) -> List[str]:
+        """Main method to process any document"""
+        if not os.path.exists(file_path):
+            raise Exception(f"File not found: {file_path}")
+        
+        _, ext = os.path.splitext(file_path)
+        with open(file_path, 'rb') as stream:
+            return self.process_stream(stream, ext)
@@ -0,0 +1,115 @@
+import os
+import pickle
+import hashlib
+import numpy as np
+from typing import Dict, List
+
+class EmbeddingCache:
+    """Persistent chunk embedding cache: a raw float32 append log plus a {sha256: row} index"""
+
+    def __init__(self, cache_directory: str, model_name: str):
+        self.cache_directory = cache_directory
+        self.model_name = model_name
+        self.index: Dict[str, int] = {}
+        self.dim = 0
+
+        os.makedirs(cache_directory, exist_ok=True)
+        self.load()
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.cache_directory, filename)
+
+    def _rows_on_disk(self) -> int:
+        filepath = self._path('embeddings.f32')
+        if not self.dim or not os.path.exists(filepath):
+            return 0
+        return os.path.getsize(filepath) // (self.dim * 4)
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Return cached vectors for whichever keys are present"""
+        hits = [key for key in dict.fromkeys(keys) if key in self.index]
+        if not hits:
+            return {}
+
+        try:
+            vectors = np.memmap(self._path('embeddings.f32'), dtype=np.float32, mode='r',
+                                shape=(self._rows_on_disk(), self.dim))
+            rows = vectors[[self.index[key] for key in hits]]
+            return dict(zip(hits, rows))
+        except Exception as e:
+            print(f"Embedding cache read error: {e}")
+            return {}
+
+    def add(self, keys: List[str], vectors: np.ndarray):
+        """Append new vectors to the log and record their rows in the index"""
+        fresh = {}
+        for key, vector in zip(keys, vectors):
+            if key not in self.index and key not in fresh:
+                fresh[key] = vector
+        if not fresh:
+            return
+
+        try:
+            block = np.asarray(list(fresh.values()), dtype=np.float32)
+            if not self.dim:
+                self.dim = block.shape[1]
+
+            # Rows are counted from the log itself so a torn previous write cannot misalign the index
+            start = self._rows_on_disk()
+            with open(self._path('embeddings.f32'), 'ab') as f:
+                f.seek(start * self.dim * 4)
+                f.truncate()
+                f.write(block.tobytes())
+
+            for offset, key in enumerate(fresh):
+                self.index[key] = start + offset
+            self.save()
+
+        except Exception as e:
+            print(f"Embedding cache write error: {e}")
+
+    def save(self):
+        """Save the hash index to disk"""
+        data = {
+            'model': self.model_name,
+            'dim': self.dim,
+            'index': self.index
+        }
+        tmp_path = self._path('index.pkl.tmp')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path('index.pkl'))
+
+    def load(self):
+        """Load the hash index from disk, discarding it if the model changed"""
+        filepath = self._path('index.pkl')
+        if not os.path.exists(filepath):
+            return
+
+        try:
+            with open(filepath, 'rb') as f:
+                data = pickle.load(f)
+
+            if data.get('model') == self.model_name:
+                self.dim = data.get('dim', 0)
+                self.index = data.get('index', {})
+            else:
+                self.clear()
+
+        except Exception as e:
+            print(f"Error loading embedding cache: {e}")
+            self.clear()
+
+    def clear(self):
+        """Drop every cached vector"""
+        self.index = {}
+        self.dim = 0
+
+        for filename in ('embeddings.f32', 'index.pkl'):
+            filepath = self._path(filename)
+            if os.path.exists(filepath):
+                os.remove(filepath)
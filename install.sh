@@ -17,13 +17,14 @@ echo "Upgrading pip..."
 pip install --upgrade pip
 
 echo "Installing packages..."
-pip install streamlit==1.28.1
+pip install streamlit==1.31.1
 pip install streamlit-chat==0.1.1
 pip install python-dotenv==1.0.0
-pip install PyPDF2==3.0.1
+pip install pypdfium2==4.30.0
 pip install python-docx==1.1.0
 pip install numpy==1.24.3
 pip install tiktoken==0.5.1
+pip install sentence-transformers==2.7.0
 pip install requests==2.31.0
 
 echo "Creating .env file..."
@@ -0,0 +1,54 @@
+import numpy as np
+from typing import Dict, Hashable, List, Optional
+
+class SemanticCache:
+    """Answer cache keyed by query embedding similarity rather than exact query text"""
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 1024):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.vectors: np.ndarray = np.empty((0, 0), dtype=np.float32)
+        self.scopes: List[Hashable] = []
+        self.responses: List[Dict] = []
+
+    def lookup(self, query_vector: np.ndarray, scope: Hashable) -> Optional[Dict]:
+        """Return the stored response for the closest cached query in scope, if close enough"""
+        if not self.responses:
+            return None
+
+        similarities = self.vectors @ query_vector
+        in_scope = np.fromiter((s == scope for s in self.scopes), dtype=bool, count=len(self.scopes))
+        similarities[~in_scope] = -1.0
+
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+
+        # Move the hit to the most-recently-used end
+        vector, hit_scope, response = self.vectors[best], self.scopes.pop(best), self.responses.pop(best)
+        self.vectors = np.vstack([np.delete(self.vectors, best, axis=0), vector])
+        self.scopes.append(hit_scope)
+        self.responses.append(response)
+
+        return dict(response)
+
+    def add(self, query_vector: np.ndarray, scope: Hashable, response: Dict):
+        """Store a response, evicting the least recently used entry when full"""
+        vector = np.asarray(query_vector, dtype=np.float32)[np.newaxis, :]
+        if self.responses:
+            self.vectors = np.vstack([self.vectors, vector])
+        else:
+            self.vectors = vector
+        self.scopes.append(scope)
+        self.responses.append(dict(response))
+
+        if len(self.responses) > self.max_entries:
+            self.vectors = self.vectors[1:]
+            self.scopes.pop(0)
+            self.responses.pop(0)
+
+    def clear(self):
+        """Drop every cached answer"""
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.scopes = []
+        self.responses = []
@@ -1,180 +1,419 @@
 import os
 import json
-import hashlib
 import numpy as np
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import TYPE_CHECKING, Callable, List, Dict, Optional
+
+from embedding_cache import EmbeddingCache
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+ENCODE_BATCH_SIZE = 128
+GPU_ENCODE_BATCH_SIZE = 256
+ENCODE_GROUP_SIZE = 4096
+
+# Brute-force scoring is fast enough below this many chunks; above it, use HNSW when available
+ANN_THRESHOLD = 2000
+ANN_EF_SEARCH = 64
+
+# Unit-norm components lie in [-1, 1], so one fixed scale maps them onto int8
+QUANT_SCALE = 127.0
+SCORE_BLOCK_ROWS = 8192
+
+QUERY_CACHE_SIZE = 64
+
+def select_device() -> str:
+    """Pick the fastest available torch device for embedding inference"""
+    import torch
+    
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) is not None and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+def load_embedding_model(model_name: str = EMBEDDING_MODEL, device: Optional[str] = None) -> "SentenceTransformer":
+    """Load a SentenceTransformer on the given device, or the best available one"""
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, device=device or select_device())
 
 class VectorStore:
-    def __init__(self, persist_directory: str = "./vector_data"):
+    def __init__(self, persist_directory: str = "./vector_data", model_name: str = EMBEDDING_MODEL,
+                 model_loader: Optional[Callable[[str, str], "SentenceTransformer"]] = None):
         self.persist_directory = persist_directory
+        self.model_name = model_name
+        self.model_loader = model_loader or load_embedding_model
+        self._model: Optional["SentenceTransformer"] = None
+        self.device: Optional[str] = None
         self.documents: List[str] = []
-        self.embeddings: List[List[float]] = []
-        self.metadata: List[Dict] = []
+        self.embeddings: np.ndarray = np.empty((0, 0), dtype=np.int8)
+        # Per-chunk metadata as parallel arrays aligned with self.documents
+        self.sources: List[str] = []
+        self.word_counts: np.ndarray = np.empty(0, dtype=np.int32)
+        self.char_counts: np.ndarray = np.empty(0, dtype=np.int32)
+        self.ann_index = None
+        self._q_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
         
         os.makedirs(persist_directory, exist_ok=True)
+        self.embedding_cache = EmbeddingCache(
+            os.path.join(persist_directory, 'embedding_cache'), model_name
+        )
         self.load()
     
-    def create_single_embedding(self, text: str) -> List[float]:
-        """Create simple hash-based embedding for a text"""
-        hash_obj = hashlib.sha256(text.encode('utf-8'))
-        hex_hash = hash_obj.hexdigest()
+    @property
+    def model(self) -> "SentenceTransformer":
+        """Embedding model, loaded on first use"""
+        if self._model is None:
+            # Remember the chosen device: the model may not report it until its first encode
+            self.device = select_device()
+            self._model = self.model_loader(self.model_name, self.device)
+        return self._model
+    
+    def create_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Create embeddings for multiple texts in large batched calls"""
+        # One encode call per ENCODE_GROUP_SIZE texts keeps the model's matmuls saturated
+        # while bounding the memory held by a single call; accelerators take larger batches
+        model = self.model
+        batch_size = ENCODE_BATCH_SIZE if self.device == "cpu" else GPU_ENCODE_BATCH_SIZE
+        groups = []
+        for start in range(0, len(texts), ENCODE_GROUP_SIZE):
+            groups.append(model.encode(
+                texts[start:start + ENCODE_GROUP_SIZE],
+                batch_size=batch_size,
+                show_progress_bar=False,
+                normalize_embeddings=True,
+                convert_to_numpy=True
+            ))
         
-        vector = []
-        for i in range(0, min(128, len(hex_hash)), 2):
-            byte_pair = hex_hash[i:i+2]
-            if len(byte_pair) == 2:
-                vector.append(int(byte_pair, 16) / 255.0)
-            else:
-                vector.append(0.0)
+        if len(groups) == 1:
+            return groups[0].astype(np.float32)
+        return np.concatenate(groups).astype(np.float32)
+    
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        """L2-normalize rows so cosine similarity reduces to a dot product"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+    
+    @staticmethod
+    def quantize(vectors: np.ndarray) -> np.ndarray:
+        """Scalar-quantize unit vectors to int8"""
+        return np.round(np.asarray(vectors, dtype=np.float32) * QUANT_SCALE).astype(np.int8)
+    
+    @staticmethod
+    def dequantize(vectors: np.ndarray) -> np.ndarray:
+        """Map int8 vectors back to approximate float32 unit vectors"""
+        return np.asarray(vectors, dtype=np.float32) / QUANT_SCALE
+    
+    def score(self, query_embedding: np.ndarray) -> np.ndarray:
+        """Cosine score of every stored chunk against a unit query vector"""
+        # Dequantize in fixed-size blocks so the float32 temporaries stay small
+        scores = np.empty(len(self.embeddings), dtype=np.float32)
+        for start in range(0, len(self.embeddings), SCORE_BLOCK_ROWS):
+            block = self.embeddings[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[start:start + len(block)] = block @ query_embedding
+        return scores / QUANT_SCALE
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embed a single query as a unit vector, reusing recent results"""
+        vector = self._q_cache.get(query)
+        if vector is None:
+            vector = self.normalize(self.create_embeddings([query]))[0]
+            self._q_cache[query] = vector
+            if len(self._q_cache) > QUERY_CACHE_SIZE:
+                self._q_cache.popitem(last=False)
+        else:
+            self._q_cache.move_to_end(query)
+        return vector
+    
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        """Embed document chunks, encoding only those not already in the embedding cache"""
+        keys = [EmbeddingCache.content_hash(text) for text in texts]
+        vectors = self.embedding_cache.get_many(keys)
         
-        while len(vector) < 128:
-            vector.append(0.0)
+        misses = [i for i, key in enumerate(keys) if key not in vectors]
+        if misses:
+            encoded = self.normalize(self.create_embeddings([texts[i] for i in misses]))
+            miss_keys = [keys[i] for i in misses]
+            self.embedding_cache.add(miss_keys, encoded)
+            vectors.update(zip(miss_keys, encoded))
         
-        return vector
+        return np.vstack([vectors[key] for key in keys]).astype(np.float32)
     
-    def create_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Create embeddings for multiple texts"""
-        return [self.create_single_embedding(text) for text in texts]
+    @staticmethod
+    def count_words_and_chars(documents: List[str]):
+        """Word and character counts for each chunk"""
+        word_counts = np.fromiter((len(doc.split()) for doc in documents), dtype=np.int32, count=len(documents))
+        char_counts = np.fromiter((len(doc) for doc in documents), dtype=np.int32, count=len(documents))
+        return word_counts, char_counts
     
-    def add_documents(self, documents: List[str], metadata: Optional[List[Dict]] = None):
+    def add_documents(self, documents: List[str], source_file: Optional[str] = None):
         """Add documents to the vector store"""
         if not documents:
             return
         
         try:
-            embeddings = self.create_embeddings(documents)
+            embeddings = self.quantize(self.embed_documents(documents))
             
             self.documents.extend(documents)
-            self.embeddings.extend(embeddings)
-            
-            if metadata:
-                self.metadata.extend(metadata)
+            if self.embeddings.size:
+                self.embeddings = np.vstack([self.embeddings, embeddings])
             else:
-                base_index = len(self.documents) - len(documents)
-                self.metadata.extend([{
-                    "id": base_index + i,
-                    "added": datetime.now().isoformat(),
-                    "words": len(doc.split()),
-                    "chars": len(doc)
-                } for i, doc in enumerate(documents)])
+                self.embeddings = embeddings
+            
+            word_counts, char_counts = self.count_words_and_chars(documents)
+            self.word_counts = np.concatenate([self.word_counts, word_counts])
+            self.char_counts = np.concatenate([self.char_counts, char_counts])
+            self.sources.extend([source_file or ""] * len(documents))
             
+            self._sync_ann_index()
             self.save()
             
         except Exception as e:
             print(f"Error adding documents: {e}")
             raise
     
-    def cosine_similarity(self, vec1: List[float], vec2: List[float]) -> float:
-        """Calculate cosine similarity between two vectors"""
-        vec1_array = np.array(vec1)
-        vec2_array = np.array(vec2)
-        
-        dot_product = np.dot(vec1_array, vec2_array)
-        norm1 = np.linalg.norm(vec1_array)
-        norm2 = np.linalg.norm(vec2_array)
-        
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
-        
-        similarity = dot_product / (norm1 * norm2)
-        return max(0.0, min(1.0, similarity))
-    
     def search(self, query: str, k: int = 4, min_score: float = 0.1) -> List[Dict]:
-        """Search for similar documents"""
-        if not self.documents:
-            return []
-        
+        """Search for similar documents, returning no results on failure"""
         try:
-            query_embeddings = self.create_embeddings([query])
-            query_embedding = query_embeddings[0]
-            
-            similarities = []
-            for doc_embedding in self.embeddings:
-                similarity = self.cosine_similarity(query_embedding, doc_embedding)
-                similarities.append(similarity)
-            
-            top_indices = np.argsort(similarities)[-k:][::-1]
-            
-            results = []
-            for idx in top_indices:
-                score = similarities[idx]
-                
-                if score < min_score:
-                    continue
-                
-                result = {
-                    'content': self.documents[idx],
-                    'score': float(score),
-                    'similarity_percent': f"{score * 100:.1f}%",
-                    'metadata': self.metadata[idx] if idx < len(self.metadata) else {},
-                    'rank': len(results) + 1
-                }
-                results.append(result)
-            
-            return results
-            
+            return self.search_or_raise(query, k=k, min_score=min_score)
         except Exception as e:
             print(f"Search error: {e}")
             return []
     
+    def search_or_raise(self, query: str, k: int = 4, min_score: float = 0.1) -> List[Dict]:
+        """Search for similar documents, letting model or index errors propagate"""
+        if not self.documents:
+            return []
+        
+        query_embedding = self.embed_query(query)
+        k = min(k, len(self.documents))
+        
+        if self.ann_index is not None:
+            # Walk the HNSW graph instead of scoring every chunk
+            self.ann_index.set_ef(max(ANN_EF_SEARCH, k))
+            labels, distances = self.ann_index.knn_query(query_embedding, k=k)
+            top_indices = labels[0].astype(np.int64)
+            top_scores = np.clip(1.0 - distances[0], 0.0, 1.0)
+        else:
+            # Rows are unit vectors, so matrix-vector products give every cosine score
+            similarities = np.clip(self.score(query_embedding), 0.0, 1.0)
+        
+            # Partition out the top k in O(N), then sort only those k
+            if k < len(similarities):
+                top_indices = np.argpartition(-similarities, k)[:k]
+            else:
+                top_indices = np.arange(len(similarities))
+            top_indices = top_indices[np.argsort(-similarities[top_indices])]
+            top_scores = similarities[top_indices]
+        
+        results = []
+        for idx, score in zip(top_indices, top_scores):
+            if score < min_score:
+                continue
+        
+            result = {
+                'content': self.documents[idx],
+                'score': float(score),
+                'similarity_percent': f"{score * 100:.1f}%",
+                'metadata': {
+                    'source_file': self.sources[idx],
+                    'chunk_id': int(idx),
+                    'word_count': int(self.word_counts[idx]),
+                    'char_count': int(self.char_counts[idx])
+                },
+                'rank': len(results) + 1
+            }
+            results.append(result)
+        
+        return results
+    
+    def _sync_ann_index(self):
+        """Build or extend the HNSW index once the corpus is large enough to benefit"""
+        total = len(self.documents)
+        if hnswlib is None or total <= ANN_THRESHOLD:
+            self.ann_index = None
+            return
+        
+        if self.ann_index is None:
+            self.ann_index = hnswlib.Index(space='cosine', dim=self.embeddings.shape[1])
+            self.ann_index.init_index(max_elements=total, M=16, ef_construction=200)
+        elif self.ann_index.get_max_elements() < total:
+            self.ann_index.resize_index(total)
+        
+        indexed = self.ann_index.get_current_count()
+        if indexed < total:
+            self.ann_index.add_items(self.dequantize(self.embeddings[indexed:]), np.arange(indexed, total))
+    
+    def _load_ann_index(self):
+        """Load the saved HNSW index, rebuilding it if missing or out of date"""
+        self.ann_index = None
+        filepath = self._path('ann_index.bin')
+        
+        if hnswlib is not None and len(self.documents) > ANN_THRESHOLD and os.path.exists(filepath):
+            try:
+                index = hnswlib.Index(space='cosine', dim=self.embeddings.shape[1])
+                index.load_index(filepath, max_elements=len(self.documents))
+                if index.get_current_count() <= len(self.documents):
+                    self.ann_index = index
+            except Exception as e:
+                print(f"Error loading ANN index: {e}")
+        
+        self._sync_ann_index()
+    
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.persist_directory, filename)
+    
     def save(self):
         """Save vector store data to disk"""
         try:
-            data = {
-                'documents': self.documents,
-                'embeddings': self.embeddings,
-                'metadata': self.metadata,
+            # Write to temp files and swap them in, so a memory-mapped copy of the
+            # previous embeddings file is never truncated underneath a reader
+            emb_tmp = self._path('embeddings.tmp.npy')
+            np.save(emb_tmp, np.ascontiguousarray(self.embeddings, dtype=np.int8))
+            
+            docs_tmp = self._path('documents.jsonl.tmp')
+            with open(docs_tmp, 'w', encoding='utf-8') as f:
+                for doc, source in zip(self.documents, self.sources):
+                    f.write(json.dumps({'document': doc, 'source_file': source}) + '\n')
+            
+            stats_tmp = self._path('chunk_stats.tmp.npz')
+            np.savez(stats_tmp, word_counts=self.word_counts, char_counts=self.char_counts)
+            
+            info = {
+                'embedding_model': self.model_name,
                 'saved_at': datetime.now().isoformat(),
-                'version': '1.0',
+                'version': '3.0',
                 'total_documents': len(self.documents)
             }
+            info_tmp = self._path('store_info.json.tmp')
+            with open(info_tmp, 'w', encoding='utf-8') as f:
+                json.dump(info, f, indent=2)
+            
+            os.replace(emb_tmp, self._path('embeddings.npy'))
+            os.replace(docs_tmp, self._path('documents.jsonl'))
+            os.replace(stats_tmp, self._path('chunk_stats.npz'))
+            os.replace(info_tmp, self._path('store_info.json'))
             
-            filepath = os.path.join(self.persist_directory, 'vector_store.json')
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, default=str)
+            if self.ann_index is not None:
+                ann_tmp = self._path('ann_index.bin.tmp')
+                self.ann_index.save_index(ann_tmp)
+                os.replace(ann_tmp, self._path('ann_index.bin'))
+            elif os.path.exists(self._path('ann_index.bin')):
+                os.remove(self._path('ann_index.bin'))
             
         except Exception as e:
             print(f"Error saving to disk: {e}")
     
     def load(self):
         """Load vector store data from disk"""
-        filepath = os.path.join(self.persist_directory, 'vector_store.json')
+        if not os.path.exists(self._path('store_info.json')):
+            self._load_legacy_json()
+            return
         
-        if os.path.exists(filepath):
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                self.documents = data.get('documents', [])
-                self.embeddings = data.get('embeddings', [])
-                self.metadata = data.get('metadata', [])
-                
-            except Exception as e:
-                print(f"Error loading from disk: {e}")
-                self.documents = []
-                self.embeddings = []
-                self.metadata = []
+        try:
+            with open(self._path('store_info.json'), 'r', encoding='utf-8') as f:
+                info = json.load(f)
+            
+            documents, sources = [], []
+            with open(self._path('documents.jsonl'), 'r', encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    documents.append(record['document'])
+                    sources.append(record.get('source_file', record.get('metadata', {}).get('source_file', '')))
+            
+            self.documents = documents
+            self.sources = sources
+            
+            stats_path = self._path('chunk_stats.npz')
+            if os.path.exists(stats_path):
+                with np.load(stats_path) as stats:
+                    self.word_counts = stats['word_counts']
+                    self.char_counts = stats['char_counts']
+            if len(self.word_counts) != len(self.documents):
+                self.word_counts, self.char_counts = self.count_words_and_chars(self.documents)
+            
+            if info.get('embedding_model') == self.model_name:
+                # Memory-map so only the pages search actually touches are read
+                self.embeddings = np.load(self._path('embeddings.npy'), mmap_mode='r')
+                if self.embeddings.dtype != np.int8:
+                    self.embeddings = self.quantize(self.embeddings)
+                    self.save()
+                self._load_ann_index()
+            elif self.documents:
+                self.embeddings = self.quantize(self.embed_documents(self.documents))
+                self._sync_ann_index()
+                self.save()
+            
+        except Exception as e:
+            print(f"Error loading from disk: {e}")
+            self.documents = []
+            self.embeddings = np.empty((0, 0), dtype=np.int8)
+            self.sources = []
+            self.word_counts = np.empty(0, dtype=np.int32)
+            self.char_counts = np.empty(0, dtype=np.int32)
+            self.ann_index = None
+    
+    def _load_legacy_json(self):
+        """Migrate a store saved as vector_store.json to the current layout"""
+        filepath = self._path('vector_store.json')
+        if not os.path.exists(filepath):
+            return
+        
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            
+            self.documents = data.get('documents', [])
+            self.sources = [meta.get('source_file', '') for meta in data.get('metadata', [])]
+            self.sources += [''] * (len(self.documents) - len(self.sources))
+            self.word_counts, self.char_counts = self.count_words_and_chars(self.documents)
+            if self.documents:
+                self.embeddings = self.quantize(self.embed_documents(self.documents))
+                self._sync_ann_index()
+                self.save()
+            os.remove(filepath)
+            
+        except Exception as e:
+            print(f"Error loading from disk: {e}")
+            self.documents = []
+            self.embeddings = np.empty((0, 0), dtype=np.int8)
+            self.sources = []
+            self.word_counts = np.empty(0, dtype=np.int32)
+            self.char_counts = np.empty(0, dtype=np.int32)
+            self.ann_index = None
     
     def clear(self):
         """Clear all documents from the vector store"""
         self.documents = []
-        self.embeddings = []
-        self.metadata = []
+        self.embeddings = np.empty((0, 0), dtype=np.int8)
+        self.sources = []
+        self.word_counts = np.empty(0, dtype=np.int32)
+        self.char_counts = np.empty(0, dtype=np.int32)
+        self.ann_index = None
         
-        filepath = os.path.join(self.persist_directory, 'vector_store.json')
-        if os.path.exists(filepath):
-            os.remove(filepath)
+        for filename in ('embeddings.npy', 'documents.jsonl', 'chunk_stats.npz', 'store_info.json',
+                         'ann_index.bin', 'vector_store.json'):
+            filepath = self._path(filename)
+            if os.path.exists(filepath):
+                os.remove(filepath)
     
     def get_info(self) -> Dict:
         """Get information about the vector store"""
-        total_chars = sum(len(doc) for doc in self.documents)
-        total_words = sum(len(doc.split()) for doc in self.documents)
-        
         return {
             "total_documents": len(self.documents),
-            "total_words": total_words,
-            "total_chars": total_chars,
-            "embedding_type": "Simple Hash",
-            "embedding_dimensions": len(self.embeddings[0]) if self.embeddings else 0
+            "total_words": int(self.word_counts.sum()),
+            "total_chars": int(self.char_counts.sum()),
+            "embedding_type": self.model_name,
+            "embedding_dimensions": self.embeddings.shape[1] if self.embeddings.size else 0
         }
\ No newline at end of file